@@ -0,0 +1,327 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING
+from . import models
+
+# Punches by the same card further apart than this start a new visit (seconds)
+VISIT_GAP_SECONDS = int(os.getenv("ANALYTICS_VISIT_GAP_SECONDS", "1800"))
+# Reports whose window reaches into the present are recomputed after this long (seconds)
+LIVE_CACHE_TTL = int(os.getenv("ANALYTICS_LIVE_CACHE_TTL", "60"))
+MAX_CACHED_REPORTS = 256
+# Closed days kept as mergeable partials per arcade; the default covers the longest window (days=366)
+MAX_CACHED_DAYS_PER_ARCADE = int(os.getenv("ANALYTICS_MAX_CACHED_DAYS_PER_ARCADE", "366"))
+
+HOURS_PER_WEEK = 7 * 24
+
+
+async def ensure_indexes(db):
+    await db[models.COLLECTION_TRANSACTIONS].create_index([("arcade_id", ASCENDING), ("timestamp", ASCENDING)])
+
+
+def _columns_pipeline(arcade_id, start, end):
+    """
+    Groups the window's transactions by hour and pushes each field into its
+    own array, so every document coming back is a ready-made column batch
+    instead of one dict per transaction.
+    """
+    return [
+        {"$match": {
+            "arcade_id": arcade_id,
+            "timestamp": {"$gte": start, "$lt": end},
+            "type": {"$in": ["CREDIT", "PUNCH"]}
+        }},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}},
+            "ts": {"$push": {"$toLong": "$timestamp"}},
+            "card": {"$push": {"$ifNull": ["$card_id", ""]}},
+            "machine": {"$push": {"$ifNull": ["$machine_id", ""]}},
+            "amount": {"$push": {"$toDouble": "$amount"}},
+            "punch": {"$push": {"$eq": ["$type", "PUNCH"]}}
+        }}
+    ]
+
+
+async def load_columns(db, arcade_id, start, end):
+    ts, card, machine, amount, punch = [], [], [], [], []
+    cursor = db[models.COLLECTION_TRANSACTIONS].aggregate(
+        _columns_pipeline(arcade_id, start, end), allowDiskUse=True
+    )
+    async for batch in cursor:
+        ts.append(np.asarray(batch["ts"], dtype=np.int64))
+        card.append(np.asarray(batch["card"], dtype=object))
+        machine.append(np.asarray(batch["machine"], dtype=object))
+        amount.append(np.asarray(batch["amount"], dtype=np.float64))
+        punch.append(np.asarray(batch["punch"], dtype=bool))
+
+    if not ts:
+        return None
+    return {
+        "ts": np.concatenate(ts),
+        "card": np.concatenate(card),
+        "machine": np.concatenate(machine),
+        "amount": np.concatenate(amount),
+        "punch": np.concatenate(punch)
+    }
+
+
+_EMPTY_SERIES = pd.Series(dtype=np.int64)
+
+
+def _empty_columns():
+    return {
+        "ts": np.empty(0, dtype=np.int64),
+        "card": np.empty(0, dtype=object),
+        "machine": np.empty(0, dtype=object),
+        "amount": np.empty(0, dtype=np.float64),
+        "punch": np.empty(0, dtype=bool)
+    }
+
+
+def _slice_columns(columns, start_ms, end_ms):
+    mask = (columns["ts"] >= start_ms) & (columns["ts"] < end_ms)
+    return {name: values[mask] for name, values in columns.items()}
+
+
+def _machine_heatmaps(ts, machine, amount):
+    """Plays per machine per hour of week (Monday 00:00 UTC first), via one bincount."""
+    machine_codes, machine_ids = pd.factorize(machine)
+    stamps = pd.to_datetime(ts, unit="ms")
+    hour_of_week = stamps.dayofweek.to_numpy() * 24 + stamps.hour.to_numpy()
+
+    slots = machine_codes * HOURS_PER_WEEK + hour_of_week
+    size = len(machine_ids) * HOURS_PER_WEEK
+    plays = np.bincount(slots, minlength=size).reshape(len(machine_ids), 7, 24)
+    revenue = np.bincount(machine_codes, weights=amount, minlength=len(machine_ids))
+
+    return {machine_id: (plays[i], float(revenue[i])) for i, machine_id in enumerate(machine_ids)}
+
+
+def _count_visits(ts, card):
+    """A visit is a run of punches by one card with no gap above VISIT_GAP_SECONDS."""
+    card_codes, _ = pd.factorize(card)
+    order = np.lexsort((ts, card_codes))
+    ts, card_codes = ts[order], card_codes[order]
+
+    new_visit = np.ones(len(ts), dtype=bool)
+    new_visit[1:] = (card_codes[1:] != card_codes[:-1]) | (np.diff(ts) > VISIT_GAP_SECONDS * 1000)
+    return int(new_visit.sum())
+
+
+def compute_partial(columns):
+    """
+    Mergeable summary of one slice of the ledger. Besides additive counts it
+    keeps each card's first and last punch and first recharge, which is
+    what merging needs to join visits across slices and to judge conversion.
+    """
+    punch = columns["punch"]
+    play_ts = columns["ts"][punch]
+    play_card = columns["card"][punch]
+    play_amount = columns["amount"][punch]
+    credit_ts = columns["ts"][~punch]
+    credit_card = columns["card"][~punch]
+
+    partial = {
+        "transactions": int(len(punch)),
+        "plays": int(len(play_ts)),
+        "cards": pd.unique(columns["card"]),
+        "machines": {},
+        "visits": 0,
+        "played": float(play_amount.sum()),
+        "credited": float(columns["amount"][~punch].sum()),
+        "first_play": _EMPTY_SERIES,
+        "last_play": _EMPTY_SERIES,
+        "first_credit": _EMPTY_SERIES
+    }
+    if len(play_ts):
+        partial["machines"] = _machine_heatmaps(play_ts, columns["machine"][punch], play_amount)
+        partial["visits"] = _count_visits(play_ts, play_card)
+        plays_by_card = pd.Series(play_ts).groupby(play_card, sort=False)
+        partial["first_play"] = plays_by_card.min()
+        partial["last_play"] = plays_by_card.max()
+    if len(credit_ts):
+        partial["first_credit"] = pd.Series(credit_ts).groupby(credit_card, sort=False).min()
+    return partial
+
+
+def merge_partials(partials):
+    """Combines chronologically ordered partials into the final report metrics."""
+    transactions = plays = visits = 0
+    played = credited = 0.0
+    machines = {}
+    cards = []
+    last_play = _EMPTY_SERIES
+    first_credits = []
+
+    for partial in partials:
+        transactions += partial["transactions"]
+        plays += partial["plays"]
+        played += partial["played"]
+        credited += partial["credited"]
+        cards.append(partial["cards"])
+        first_credits.append(partial["first_credit"])
+        for machine_id, (heatmap, revenue) in partial["machines"].items():
+            if machine_id in machines:
+                machines[machine_id] = (machines[machine_id][0] + heatmap, machines[machine_id][1] + revenue)
+            else:
+                machines[machine_id] = (heatmap, revenue)
+
+        # A visit that crossed into this slice was counted once on each side
+        visits += partial["visits"]
+        if len(partial["first_play"]) and len(last_play):
+            first = partial["first_play"]
+            previous = last_play.reindex(first.index)
+            visits -= int(((first - previous) <= VISIT_GAP_SECONDS * 1000).sum())
+        if len(partial["last_play"]):
+            last_play = pd.concat([last_play, partial["last_play"]]).groupby(level=0).max()
+
+    first_credit = pd.concat(first_credits).groupby(level=0).min() if first_credits else _EMPTY_SERIES
+    converted = int((last_play.reindex(first_credit.index) >= first_credit).sum())
+    unique_cards = pd.unique(np.concatenate(cards)) if cards else []
+
+    return {
+        "transactions": transactions,
+        "plays": plays,
+        "active_cards": int(len(unique_cards)),
+        "machines": {
+            machine_id: {"plays": int(heatmap.sum()), "revenue": revenue, "heatmap": heatmap.tolist()}
+            for machine_id, (heatmap, revenue) in machines.items()
+        },
+        "visits": {
+            "visits": visits,
+            "avg_spend_per_visit": played / visits if visits else None,
+            "avg_plays_per_visit": plays / visits if visits else None
+        },
+        "conversion": {
+            "recharging_cards": int(len(first_credit)),
+            "converted_cards": converted,
+            "conversion_rate": converted / len(first_credit) if len(first_credit) else None,
+            "recharged_amount": credited,
+            "played_amount": played,
+            "play_to_recharge_ratio": played / credited if credited else None
+        }
+    }
+
+
+class AnalyticsCache:
+    """
+    LRU keyed by arcade and window, or by day within one arcade. Anything that ended before now
+    can no longer change, so it is kept until evicted; entries reaching
+    into the present expire after LIVE_CACHE_TTL seconds.
+    """
+
+    def __init__(self, max_entries: int = MAX_CACHED_REPORTS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        report, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return report
+
+    def put(self, key, report, immutable: bool):
+        expires_at = None if immutable else time.monotonic() + LIVE_CACHE_TTL
+        self._entries[key] = (report, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+analytics_cache = AnalyticsCache()
+# Partials of closed UTC days, shared by every window that covers them. One
+# LRU per arcade, so a busy arcade cannot evict everybody else's history.
+day_caches = {}
+
+
+def _day_cache(arcade_id) -> AnalyticsCache:
+    cache = day_caches.get(arcade_id)
+    if cache is None:
+        cache = day_caches[arcade_id] = AnalyticsCache(max_entries=MAX_CACHED_DAYS_PER_ARCADE)
+    return cache
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_ms(dt: datetime) -> int:
+    return int((dt - _EPOCH) / timedelta(milliseconds=1))
+
+
+def default_window(days: int):
+    # Whole hours, so repeated dashboard loads within the hour share a cache key
+    end = datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return end - timedelta(days=days), end
+
+
+def _segments(start, end, now):
+    """
+    Cuts the window at UTC midnights. Whole days that ended before now are
+    immutable and can be served from the arcade's day cache; the partial head and tail
+    and anything still open are always read fresh.
+    """
+    segments = []
+    cursor = start
+    while cursor < end:
+        next_midnight = cursor.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        seg_end = min(next_midnight, end)
+        whole_day = cursor == next_midnight - timedelta(days=1) and seg_end == next_midnight
+        segments.append((cursor, seg_end, whole_day and seg_end <= now))
+        cursor = seg_end
+    return segments
+
+
+async def get_report(db, arcade_id, start, end):
+    key = (arcade_id, start, end)
+    report = analytics_cache.get(key)
+    if report is not None:
+        return {**report, "cached": True}
+
+    now = datetime.utcnow()
+    segments = _segments(start, end, now)
+    day_cache = _day_cache(arcade_id)
+    partials = [day_cache.get(seg_start) if closed else None for seg_start, _, closed in segments]
+    days_from_cache = sum(1 for partial in partials if partial is not None)
+
+    # Read each run of missing segments with a single query, then slice it per segment
+    missing_runs = []
+    for i, partial in enumerate(partials):
+        if partial is not None:
+            continue
+        if missing_runs and missing_runs[-1][-1] == i - 1:
+            missing_runs[-1].append(i)
+        else:
+            missing_runs.append([i])
+
+    for run in missing_runs:
+        run_start, run_end = segments[run[0]][0], segments[run[-1]][1]
+        columns = await load_columns(db, arcade_id, run_start, run_end) or _empty_columns()
+        # Keep the number crunching off the event loop so swipes are not held up
+        computed = await asyncio.to_thread(lambda: [
+            compute_partial(_slice_columns(columns, _to_ms(segments[i][0]), _to_ms(segments[i][1])))
+            for i in run
+        ])
+        for i, partial in zip(run, computed):
+            partials[i] = partial
+            if segments[i][2]:
+                day_cache.put(segments[i][0], partial, immutable=True)
+
+    metrics = await asyncio.to_thread(merge_partials, partials)
+    report = {
+        "arcade_id": arcade_id,
+        "start": start,
+        "end": end,
+        "visit_gap_seconds": VISIT_GAP_SECONDS,
+        "days_from_cache": days_from_cache,
+        **metrics
+    }
+    analytics_cache.put(key, report, end <= now)
+    return {**report, "cached": False}
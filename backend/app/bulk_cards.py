@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta
+from . import models, schemas
+
+# Cards per round trip when a bulk recharge walks its targets
+CHUNK_SIZE = 5000
+# A running job that has not reported progress for this long died with its worker (seconds)
+STALE_JOB_SECONDS = 600
+
+
+def has_filter_criteria(f) -> bool:
+    # arcade_id only scopes the filter, it does not narrow it down to particular cards
+    return bool(f.status) or f.min_balance is not None or f.max_balance is not None
+
+
+def build_card_query(data, current_user):
+    """Turns a bulk action's card_ids or filter into a Mongo query, scoped to the caller's arcade."""
+    query = {}
+    if data.card_ids is not None:
+        query["card_id"] = {"$in": data.card_ids}
+    else:
+        f = data.filter
+        if f.status:
+            query["status"] = f.status
+        if f.min_balance is not None or f.max_balance is not None:
+            query["balance"] = {}
+            if f.min_balance is not None:
+                query["balance"]["$gte"] = f.min_balance
+            if f.max_balance is not None:
+                query["balance"]["$lte"] = f.max_balance
+        if f.arcade_id:
+            query["arcade_id"] = f.arcade_id
+
+    if current_user.get("role") == "manager":
+        query["arcade_id"] = current_user.get("arcade_id")
+    return query
+
+
+def job_card_query(job):
+    """Rebuilds the query a job was started with, scoped as it was for the user who created it."""
+    data = schemas.BulkCardAction(action=job["action"], amount=job["amount"], **job["selection"])
+    return build_card_query(data, {"role": job["created_by_role"], "arcade_id": job["arcade_id"]})
+
+
+async def _set_progress(db, job_id, **fields):
+    fields["updated_at"] = datetime.utcnow()
+    await db[models.COLLECTION_JOBS].update_one({"_id": job_id}, {"$set": fields})
+
+
+async def fail_if_stale(db, job):
+    """
+    Background tasks do not survive a restart, so a job left PENDING or
+    RUNNING without progress for STALE_JOB_SECONDS is marked FAILED.
+    """
+    if job["status"] not in ("PENDING", "RUNNING"):
+        return job
+    last_update = job.get("updated_at") or job["created_at"]
+    if last_update > datetime.utcnow() - timedelta(seconds=STALE_JOB_SECONDS):
+        return job
+
+    fields = {
+        "status": "FAILED",
+        "error": (
+            f"Job stopped reporting progress after {job.get('processed', 0)} of {job['total']} cards, "
+            "it was probably interrupted by a server restart"
+        ),
+        "finished_at": datetime.utcnow()
+    }
+    await db[models.COLLECTION_JOBS].update_one({"_id": job["_id"], "status": job["status"]}, {"$set": fields})
+    return {**job, **fields}
+
+
+async def _already_credited(db, job_id, cards):
+    # Ledger rows go in before balances, so a card with a row from this job was reached by the failed attempt
+    rows = await db[models.COLLECTION_TRANSACTIONS].find(
+        {
+            "arcade_id": {"$in": list({c.get("arcade_id") or "SYSTEM_ARCADE" for c in cards})},
+            "card_id": {"$in": [c["card_id"] for c in cards]},
+            "_id": {"$gt": job_id},
+            "job_id": job_id
+        },
+        {"_id": 0, "card_id": 1, "arcade_id": 1}
+    ).to_list(length=None)
+    return {(r["arcade_id"], r["card_id"]) for r in rows}
+
+
+async def _recharge(db, job_id, query, amount, resume=None):
+    """
+    Walks the matching cards in _id order, one chunk at a time: one
+    insert_many for the ledger rows and one update_many for the balances.
+    The _id of the last finished chunk is saved as last_id, so a failed
+    job can be resumed from there without crediting any card twice. If the
+    failure hit between the two writes, the cards of that chunk keep their
+    ledger row without the balance and reconciliation reports them as drift.
+    """
+    resume = resume or {}
+    last_id = resume.get("last_id")
+    processed = resume.get("processed", 0)
+    resuming = bool(resume)
+    while True:
+        page_query = dict(query)
+        if last_id is not None:
+            page_query["_id"] = {"$gt": last_id}
+        cards = await db[models.COLLECTION_CARDS].find(
+            page_query, {"_id": 1, "card_id": 1, "arcade_id": 1}
+        ).sort("_id", 1).limit(CHUNK_SIZE).to_list(length=CHUNK_SIZE)
+        if not cards:
+            break
+
+        # Only the chunk right after the cursor can have been half done by the failed attempt
+        if resuming:
+            done = await _already_credited(db, job_id, cards)
+            pending = [c for c in cards if (c.get("arcade_id") or "SYSTEM_ARCADE", c["card_id"]) not in done]
+            resuming = False
+        else:
+            pending = cards
+
+        if pending:
+            now = datetime.utcnow()
+            await db[models.COLLECTION_TRANSACTIONS].insert_many([
+                {
+                    "card_id": c["card_id"],
+                    "amount": amount,
+                    "type": "CREDIT",
+                    "terminal": "Bulk Action",
+                    "status": "SUCCESS",
+                    "timestamp": now,
+                    "arcade_id": c.get("arcade_id") or "SYSTEM_ARCADE",
+                    "job_id": job_id
+                }
+                for c in pending
+            ], ordered=False)
+
+            await db[models.COLLECTION_CARDS].update_many(
+                {"_id": {"$in": [c["_id"] for c in pending]}},
+                {"$inc": {"balance": amount}}
+            )
+
+        processed += len(cards)
+        last_id = cards[-1]["_id"]
+        await _set_progress(db, job_id, processed=processed, last_id=last_id)
+    return processed
+
+
+async def run_bulk_card_action(db, job_id, action, query, amount=None, arcade_id=None, resume=None):
+    """
+    Background task behind /manager/cards/bulk-action. Progress is tracked
+    on the job document; a resumed job passes its saved last_id and
+    processed count back in as resume.
+    """
+    await _set_progress(db, job_id, status="RUNNING", started_at=datetime.utcnow())
+    try:
+        if action == "recharge":
+            processed = await _recharge(db, job_id, query, amount, resume)
+            message = f"Bulk recharged {processed} cards with {amount}"
+        elif action in ("block", "unblock"):
+            new_status = "BLOCKED" if action == "block" else "ACTIVE"
+            result = await db[models.COLLECTION_CARDS].update_many(query, {"$set": {"status": new_status}})
+            processed = result.matched_count
+            message = f"Bulk {action}ed {processed} cards"
+        else:
+            result = await db[models.COLLECTION_CARDS].delete_many(query)
+            processed = result.deleted_count
+            message = f"Bulk deleted {processed} cards"
+    except Exception as e:
+        await _set_progress(db, job_id, status="FAILED", error=str(e), finished_at=datetime.utcnow())
+        return
+
+    await _set_progress(db, job_id, status="COMPLETED", processed=processed, finished_at=datetime.utcnow())
+
+    log = {
+        "type": "WARNING" if action in ("block", "delete") else "INFO",
+        "message": message,
+        "source": "Manager Ops",
+        "timestamp": datetime.utcnow(),
+        "arcade_id": arcade_id or "SYSTEM_ARCADE"
+    }
+    await db[models.COLLECTION_LOGS].insert_one(log)
@@ -0,0 +1,177 @@
+import os
+import re
+import hmac
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordBearer
+from . import database, models, security
+from .dependencies import get_current_user
+
+# Signed terminal requests may be this far off the server clock (seconds)
+MAX_CLOCK_SKEW = int(os.getenv("MACHINE_AUTH_MAX_SKEW", "300"))
+# How long a machine key stays cached before it is re-read from MongoDB (seconds)
+KEY_CACHE_TTL = int(os.getenv("MACHINE_KEY_CACHE_TTL", "300"))
+# Unknown machine IDs are remembered this long, so they cannot force a DB read per request (seconds)
+MISS_CACHE_TTL = int(os.getenv("MACHINE_KEY_MISS_TTL", "60"))
+MAX_CACHED_MISSES = 10000
+
+_SIGNATURE_RE = re.compile(r"[0-9a-f]{64}")
+
+# Same scheme as dependencies.oauth2_scheme, but a missing header is not an error
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+_MACHINE_FIELDS = {"_id": 0, "id": 1, "name": 1, "cost_per_play": 1, "arcade_id": 1, "secret_key": 1}
+
+
+class MachineKeyCache:
+    """
+    In-process table of machine secrets, so verifying a swipe does not
+    touch the database. Entries expire after KEY_CACHE_TTL seconds.
+    Unknown IDs are kept in a bounded miss table for MISS_CACHE_TTL seconds.
+    """
+
+    def __init__(self, ttl: int = KEY_CACHE_TTL, miss_ttl: int = MISS_CACHE_TTL):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._entries = {}
+        self._misses = OrderedDict()
+
+    async def get(self, db, arcade_id: str, machine_id: str) -> Optional[dict]:
+        # Machine IDs are only unique within an arcade, same as the JWT punch lookup
+        key = (arcade_id, machine_id)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and entry[1] > now:
+            return entry[0]
+        miss_until = self._misses.get(key)
+        if miss_until and miss_until > now:
+            return None
+
+        machine = await db[models.COLLECTION_MACHINES].find_one(
+            {"id": machine_id, "arcade_id": arcade_id}, _MACHINE_FIELDS
+        )
+        if not machine or not machine.get("secret_key"):
+            self._entries.pop(key, None)
+            self._misses[key] = now + self.miss_ttl
+            self._misses.move_to_end(key)
+            while len(self._misses) > MAX_CACHED_MISSES:
+                self._misses.popitem(last=False)
+            return None
+        self._misses.pop(key, None)
+        self._entries[key] = (machine, now + self.ttl)
+        return machine
+
+    def invalidate(self, arcade_id: str, machine_id: str):
+        self._entries.pop((arcade_id, machine_id), None)
+        self._misses.pop((arcade_id, machine_id), None)
+
+
+class NonceWindow:
+    """
+    Remembers the nonces seen in the last 2 * MAX_CLOCK_SKEW seconds.
+    Anything older is already rejected by the timestamp check, so the
+    window never has to grow beyond that.
+    """
+
+    def __init__(self, span: int = 2 * MAX_CLOCK_SKEW):
+        self.span = span
+        self._seen = set()
+        self._order = deque()
+
+    def _prune(self, now: float):
+        while self._order and self._order[0][0] <= now:
+            _, key = self._order.popleft()
+            self._seen.discard(key)
+
+    def check_and_add(self, machine_id: str, nonce: str) -> bool:
+        now = time.monotonic()
+        self._prune(now)
+        key = (machine_id, nonce)
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        self._order.append((now + self.span, key))
+        return True
+
+
+# NOTE: both tables live in this process. With several uvicorn workers
+# a replayed nonce is only caught by the worker that saw it first.
+machine_keys = MachineKeyCache()
+nonce_window = NonceWindow()
+
+
+async def verify_machine(request: Request, db = Depends(database.get_db)):
+    """
+    Authenticates a terminal from its X-Arcade-Id, X-Machine-Id, X-Timestamp,
+    X-Nonce and X-Signature headers. The signature is an HMAC-SHA256 of
+    "<timestamp>.<nonce>.<raw body>" keyed with the machine secret.
+    """
+    arcade_id = request.headers.get("X-Arcade-Id")
+    machine_id = request.headers.get("X-Machine-Id")
+    timestamp = request.headers.get("X-Timestamp")
+    nonce = request.headers.get("X-Nonce")
+    signature = request.headers.get("X-Signature")
+
+    if not arcade_id or not machine_id or not timestamp or not nonce or not signature:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing machine authentication headers"
+        )
+
+    # Signatures are lowercase hex SHA-256 digests; anything else can be refused without a lookup
+    if not _SIGNATURE_RE.fullmatch(signature):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid signature")
+    if len(machine_id) > 64 or len(arcade_id) > 64:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid machine")
+
+    try:
+        timestamp_int = int(timestamp)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid timestamp")
+
+    if abs(time.time() - timestamp_int) > MAX_CLOCK_SKEW:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Request expired")
+
+    machine = await machine_keys.get(db, arcade_id, machine_id)
+    if not machine:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid machine")
+
+    body = await request.body()
+    expected_signature = security.sign_machine_request(machine["secret_key"], timestamp, nonce, body)
+    if not hmac.compare_digest(expected_signature.encode(), signature.encode("latin-1")):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid signature")
+
+    # Only remember nonces of correctly signed requests, so garbage cannot fill the window
+    if not nonce_window.check_and_add(f"{arcade_id}/{machine_id}", nonce):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Replayed request")
+
+    return machine
+
+
+async def get_terminal_or_user(
+    request: Request,
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db = Depends(database.get_db)
+):
+    """
+    Lets an endpoint be called either by a signed machine terminal or by a
+    logged-in user. Machines come back shaped like a user with role "machine".
+    """
+    if request.headers.get("X-Signature"):
+        machine = await verify_machine(request, db)
+        return {
+            "username": machine["id"],
+            "role": "machine",
+            "arcade_id": machine.get("arcade_id"),
+            "machine": machine
+        }
+
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return await get_current_user(token, db)
@@ -1,10 +1,11 @@
+import asyncio
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 
 # Import our local modules
-from . import models, security, database
+from . import models, security, database, reconciliation, analytics
 from .database import get_db
 from .routers import admin, manager, operations
 
@@ -29,6 +30,11 @@ async def startup_event():
         })
         print("Default admin user created: admin / admin123")
 
+    await reconciliation.ensure_indexes(db)
+    await analytics.ensure_indexes(db)
+    if reconciliation.RECONCILIATION_INTERVAL_SECONDS > 0:
+        app.state.reconciliation_task = asyncio.create_task(reconciliation.reconciliation_worker(db))
+
 # --- CORS CONFIGURATION ---
 app.add_middleware(
     CORSMiddleware,
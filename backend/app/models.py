@@ -9,3 +9,11 @@ COLLECTION_MACHINES = "machines"
 COLLECTION_CARDS = "cards"
 COLLECTION_TRANSACTIONS = "transactions"
 COLLECTION_LOGS = "logs"
+
+# Ledger reconciliation
+COLLECTION_LEDGER_BALANCES = "ledger_balances"
+COLLECTION_RECONCILIATION_FINDINGS = "reconciliation_findings"
+COLLECTION_RECONCILIATION_STATE = "reconciliation_state"
+
+# Background jobs (bulk card actions)
+COLLECTION_JOBS = "jobs"
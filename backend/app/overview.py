@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+from datetime import datetime
+from bson import ObjectId
+from . import models
+
+# How old a cached overview may get before the next request recomputes it (seconds)
+OVERVIEW_REFRESH_SECONDS = int(os.getenv("OVERVIEW_REFRESH_SECONDS", "60"))
+
+MACHINE_STATUSES = ["ONLINE", "BUSY", "OFFLINE", "MAINTENANCE"]
+
+
+def _overview_pipeline(day_start: datetime):
+    """
+    One aggregation over arcades that pulls in cards, machines and today's
+    transactions with $unionWith, then splits them again with $facet.
+    """
+    return [
+        {"$project": {"_id": 0, "kind": {"$literal": "arcade"}, "arcade_id": "$id", "name": 1, "location": 1}},
+        {"$unionWith": {
+            "coll": models.COLLECTION_CARDS,
+            "pipeline": [{"$project": {"_id": 0, "kind": {"$literal": "card"}, "arcade_id": 1, "balance": 1, "status": 1}}]
+        }},
+        {"$unionWith": {
+            "coll": models.COLLECTION_MACHINES,
+            "pipeline": [{"$project": {"_id": 0, "kind": {"$literal": "machine"}, "arcade_id": 1, "status": 1}}]
+        }},
+        {"$unionWith": {
+            "coll": models.COLLECTION_TRANSACTIONS,
+            "pipeline": [
+                # _id bound uses the default index, timestamp keeps backfilled rows honest
+                {"$match": {"_id": {"$gte": ObjectId.from_datetime(day_start)}, "timestamp": {"$gte": day_start}}},
+                {"$project": {"_id": 0, "kind": {"$literal": "tx"}, "arcade_id": 1, "type": 1, "amount": 1}}
+            ]
+        }},
+        {"$facet": {
+            "arcades": [{"$match": {"kind": "arcade"}}],
+            "cards": [
+                {"$match": {"kind": "card"}},
+                {"$group": {
+                    "_id": "$arcade_id",
+                    "cards": {"$sum": 1},
+                    "active_cards": {"$sum": {"$cond": [{"$eq": ["$status", "ACTIVE"]}, 1, 0]}},
+                    "outstanding_balance": {"$sum": "$balance"}
+                }}
+            ],
+            "machines": [
+                {"$match": {"kind": "machine"}},
+                {"$group": {"_id": {"arcade_id": "$arcade_id", "status": "$status"}, "count": {"$sum": 1}}}
+            ],
+            "revenue": [
+                {"$match": {"kind": "tx"}},
+                {"$group": {
+                    "_id": "$arcade_id",
+                    "revenue_today": {"$sum": {"$cond": [{"$eq": ["$type", "PUNCH"]}, "$amount", 0]}},
+                    "plays_today": {"$sum": {"$cond": [{"$eq": ["$type", "PUNCH"]}, 1, 0]}},
+                    "recharges_today": {"$sum": {"$cond": [{"$eq": ["$type", "CREDIT"]}, "$amount", 0]}},
+                    "refunds_today": {"$sum": {"$cond": [{"$eq": ["$type", "DEBIT"]}, "$amount", 0]}}
+                }}
+            ]
+        }}
+    ]
+
+
+def _empty_arcade(arcade_id):
+    return {
+        "arcade_id": arcade_id,
+        "name": None,
+        "location": None,
+        "cards": 0,
+        "active_cards": 0,
+        "outstanding_balance": 0.0,
+        "machines": {s: 0 for s in MACHINE_STATUSES},
+        "revenue_today": 0.0,
+        "plays_today": 0,
+        "recharges_today": 0.0,
+        "refunds_today": 0.0
+    }
+
+
+async def compute_overview(db):
+    day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    result = await db[models.COLLECTION_ARCADES].aggregate(
+        _overview_pipeline(day_start), allowDiskUse=True
+    ).to_list(length=1)
+    facets = result[0] if result else {}
+
+    arcades = {}
+
+    def arcade(arcade_id):
+        arcade_id = arcade_id or "SYSTEM_ARCADE"
+        if arcade_id not in arcades:
+            arcades[arcade_id] = _empty_arcade(arcade_id)
+        return arcades[arcade_id]
+
+    for a in facets.get("arcades", []):
+        entry = arcade(a.get("arcade_id"))
+        entry["name"] = a.get("name")
+        entry["location"] = a.get("location")
+
+    for c in facets.get("cards", []):
+        entry = arcade(c["_id"])
+        entry["cards"] = c["cards"]
+        entry["active_cards"] = c["active_cards"]
+        entry["outstanding_balance"] = c["outstanding_balance"]
+
+    for m in facets.get("machines", []):
+        machine_status = m["_id"].get("status") or "UNKNOWN"
+        arcade(m["_id"].get("arcade_id"))["machines"][machine_status] = m["count"]
+
+    for r in facets.get("revenue", []):
+        entry = arcade(r["_id"])
+        for field in ("revenue_today", "plays_today", "recharges_today", "refunds_today"):
+            entry[field] = r[field]
+
+    return {"day_start": day_start, "arcades": sorted(arcades.values(), key=lambda a: a["arcade_id"])}
+
+
+class OverviewSnapshot:
+    """
+    Caches the latest overview. When it goes stale, the first caller
+    recomputes it while everyone else waits on the same lock and then
+    reads the fresh copy, so there is at most one query per interval.
+    """
+
+    def __init__(self, refresh_seconds: int = OVERVIEW_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._data = None
+        self._generated_at = None
+        self._computed_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self, max_age: float) -> bool:
+        return self._data is not None and time.monotonic() - self._computed_at < max_age
+
+    async def get(self, db, force: bool = False):
+        requested_at = time.monotonic()
+        if not force and self._is_fresh(self.refresh_seconds):
+            return self._snapshot()
+
+        async with self._lock:
+            # Someone else refreshed while we were waiting
+            if self._data is not None and self._computed_at >= requested_at:
+                return self._snapshot()
+            if not force and self._is_fresh(self.refresh_seconds):
+                return self._snapshot()
+
+            self._data = await compute_overview(db)
+            self._generated_at = datetime.utcnow()
+            self._computed_at = time.monotonic()
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            **self._data,
+            "generated_at": self._generated_at,
+            "age_seconds": round(time.monotonic() - self._computed_at, 3),
+            "refresh_seconds": self.refresh_seconds
+        }
+
+
+overview_snapshot = OverviewSnapshot()
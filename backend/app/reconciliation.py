@@ -0,0 +1,297 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from . import models
+
+# Nightly by default; 0 disables the background worker (the admin endpoint still works)
+RECONCILIATION_INTERVAL_SECONDS = int(os.getenv("RECONCILIATION_INTERVAL_SECONDS", "86400"))
+# Transactions younger than this are left for the next run, so in-flight swipes are not flagged
+SETTLE_SECONDS = int(os.getenv("RECONCILIATION_SETTLE_SECONDS", "60"))
+BATCH_SIZE = 1000
+# Balances are stored as floats, so ignore sub-paisa noise
+DRIFT_EPSILON = 0.005
+
+STATE_ID = "ledger"
+
+_run_lock = asyncio.Lock()
+
+# A CREDIT adds to the card, DEBIT (refund) and PUNCH take away from it
+_SIGNED_AMOUNT = {
+    "$cond": [{"$eq": ["$type", "CREDIT"]}, "$amount", {"$multiply": ["$amount", -1]}]
+}
+
+# Card IDs are only unique within an arcade. Matching both keys with plain
+# $eq lets every $lookup below walk an (arcade_id, card_id) index.
+_CARD_KEY = {"arcade_id": "$arcade_id", "card_id": "$card_id"}
+_SAME_CARD = {"$and": [
+    {"$eq": ["$arcade_id", "$$arcade_id"]},
+    {"$eq": ["$card_id", "$$card_id"]}
+]}
+
+
+async def ensure_indexes(db):
+    await db[models.COLLECTION_LEDGER_BALANCES].create_index(
+        [("arcade_id", ASCENDING), ("card_id", ASCENDING)], unique=True
+    )
+    await db[models.COLLECTION_LEDGER_BALANCES].create_index("last_run")
+    await db[models.COLLECTION_RECONCILIATION_FINDINGS].create_index(
+        [("arcade_id", ASCENDING), ("card_id", ASCENDING)], unique=True
+    )
+    await db[models.COLLECTION_RECONCILIATION_FINDINGS].create_index("status")
+    await db[models.COLLECTION_TRANSACTIONS].create_index(
+        [("arcade_id", ASCENDING), ("card_id", ASCENDING), ("_id", ASCENDING)]
+    )
+    # Also serves the card find_one calls of punch, recharge and refund
+    await db[models.COLLECTION_CARDS].create_index([("arcade_id", ASCENDING), ("card_id", ASCENDING)])
+
+
+def is_running() -> bool:
+    return _run_lock.locked()
+
+
+async def _fold_new_transactions(db, run_id, watermark, upper):
+    """
+    Adds the signed sum of every transaction in (watermark, upper) onto the
+    running per-card totals in ledger_balances. The whole fold happens
+    server-side via $merge, nothing is shipped back to the app.
+    """
+    id_range = {"$lt": upper}
+    if watermark is not None:
+        id_range["$gt"] = watermark
+
+    pipeline = [
+        {"$match": {"_id": id_range, "type": {"$in": ["CREDIT", "DEBIT", "PUNCH"]}}},
+        {"$group": {
+            "_id": {"arcade_id": {"$ifNull": ["$arcade_id", "SYSTEM_ARCADE"]}, "card_id": "$card_id"},
+            "ledger": {"$sum": _SIGNED_AMOUNT},
+            "tx_count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "arcade_id": "$_id.arcade_id",
+            "card_id": "$_id.card_id",
+            "ledger": 1,
+            "tx_count": 1,
+            "last_run": {"$literal": run_id}
+        }},
+        {"$merge": {
+            "into": models.COLLECTION_LEDGER_BALANCES,
+            "on": ["arcade_id", "card_id"],
+            "whenMatched": [{"$set": {
+                "ledger": {"$add": ["$ledger", "$$new.ledger"]},
+                "tx_count": {"$add": ["$tx_count", "$$new.tx_count"]},
+                "last_run": "$$new.last_run"
+            }}],
+            "whenNotMatched": "insert"
+        }}
+    ]
+    await db[models.COLLECTION_TRANSACTIONS].aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+
+
+def _pending_lookup(upper):
+    # A swipe that landed after the upper bound would look like drift; such cards wait for the next run
+    return {"$lookup": {
+        "from": models.COLLECTION_TRANSACTIONS,
+        "let": _CARD_KEY,
+        "pipeline": [
+            {"$match": {"_id": {"$gte": upper}, "$expr": _SAME_CARD}},
+            {"$limit": 1},
+            {"$project": {"_id": 1}}
+        ],
+        "as": "newer"
+    }}
+
+
+def _drift_pipeline(run_id, upper):
+    """
+    Compares the cards whose ledger moved in this run. Only rows that drift,
+    or that carry an OPEN finding which may now be fixed, come back.
+    """
+    return [
+        {"$match": {"last_run": run_id}},
+        {"$lookup": {
+            "from": models.COLLECTION_CARDS,
+            "let": _CARD_KEY,
+            "pipeline": [
+                {"$match": {"$expr": _SAME_CARD}},
+                {"$project": {"_id": 0, "balance": 1}}
+            ],
+            "as": "card"
+        }},
+        {"$unwind": "$card"},
+        {"$project": {
+            "_id": 0,
+            "arcade_id": 1,
+            "card_id": 1,
+            "ledger_balance": "$ledger",
+            "card_balance": "$card.balance",
+            "drift": {"$subtract": ["$card.balance", "$ledger"]}
+        }},
+        {"$addFields": {"drifting": {"$gt": [{"$abs": "$drift"}, DRIFT_EPSILON]}}},
+        {"$lookup": {
+            "from": models.COLLECTION_RECONCILIATION_FINDINGS,
+            "let": _CARD_KEY,
+            "pipeline": [
+                {"$match": {"status": "OPEN", "$expr": _SAME_CARD}},
+                {"$project": {"_id": 1}}
+            ],
+            "as": "open_finding"
+        }},
+        {"$match": {"$or": [{"drifting": True}, {"open_finding": {"$ne": []}}]}},
+        _pending_lookup(upper)
+    ]
+
+
+def _unledgered_cards_pipeline(upper):
+    # Cards holding money without a single ledger row (only checked on full runs)
+    return [
+        {"$match": {"balance": {"$ne": 0}}},
+        {"$lookup": {
+            "from": models.COLLECTION_LEDGER_BALANCES,
+            "let": _CARD_KEY,
+            "pipeline": [
+                {"$match": {"$expr": _SAME_CARD}},
+                {"$project": {"_id": 1}}
+            ],
+            "as": "ledger"
+        }},
+        {"$match": {"ledger": {"$size": 0}}},
+        {"$project": {
+            "_id": 0,
+            "arcade_id": 1,
+            "card_id": 1,
+            "ledger_balance": {"$literal": 0.0},
+            "card_balance": "$balance",
+            "drift": "$balance",
+            "drifting": {"$literal": True}
+        }},
+        _pending_lookup(upper)
+    ]
+
+
+async def _apply_checks(db, cursor, run_id):
+    """
+    Upserts drifted cards and resolves findings of cards that were compared
+    and came out clean, one batch at a time. Pending cards are left alone.
+    Returns (recorded, resolved).
+    """
+    recorded = 0
+    resolved = 0
+    while True:
+        rows = await cursor.to_list(length=BATCH_SIZE)
+        if not rows:
+            break
+
+        now = datetime.utcnow()
+        ops = []
+        clean_findings = []
+        for row in rows:
+            if row["newer"]:
+                continue
+            if not row["drifting"]:
+                clean_findings.extend(f["_id"] for f in row.get("open_finding", []))
+                continue
+            ops.append(UpdateOne(
+                {"arcade_id": row["arcade_id"], "card_id": row["card_id"]},
+                {
+                    "$set": {
+                        "card_balance": row["card_balance"],
+                        "ledger_balance": row["ledger_balance"],
+                        "drift": row["drift"],
+                        "status": "OPEN",
+                        "run_id": run_id,
+                        "last_seen_at": now
+                    },
+                    "$setOnInsert": {"detected_at": now}
+                },
+                upsert=True
+            ))
+        if ops:
+            await db[models.COLLECTION_RECONCILIATION_FINDINGS].bulk_write(ops, ordered=False)
+            recorded += len(ops)
+        if clean_findings:
+            result = await db[models.COLLECTION_RECONCILIATION_FINDINGS].update_many(
+                {"_id": {"$in": clean_findings}, "status": "OPEN"},
+                {"$set": {"status": "RESOLVED", "resolved_at": now, "run_id": run_id}}
+            )
+            resolved += result.modified_count
+    return recorded, resolved
+
+
+async def run_reconciliation(db, full: bool = False):
+    """
+    Compares every card touched since the last watermark with the sum of its
+    CREDIT, DEBIT and PUNCH rows, and records mismatches as findings.
+    A full run rebuilds the per-card ledger totals from scratch.
+    """
+    async with _run_lock:
+        started = time.monotonic()
+        state_coll = db[models.COLLECTION_RECONCILIATION_STATE]
+        state = await state_coll.find_one({"_id": STATE_ID}) or {}
+
+        # A run that died half way may already have folded its range; start over to avoid double counting
+        if state.get("in_progress") or not state.get("watermark"):
+            full = True
+
+        run_id = ObjectId()
+        watermark = None if full else state["watermark"]
+        upper = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=SETTLE_SECONDS))
+
+        await state_coll.update_one(
+            {"_id": STATE_ID},
+            {"$set": {"in_progress": {"run_id": run_id, "from": watermark, "to": upper}}},
+            upsert=True
+        )
+
+        if full:
+            await db[models.COLLECTION_LEDGER_BALANCES].delete_many({})
+        await _fold_new_transactions(db, run_id, watermark, upper)
+
+        cards_checked = await db[models.COLLECTION_LEDGER_BALANCES].count_documents({"last_run": run_id})
+        cursor = db[models.COLLECTION_LEDGER_BALANCES].aggregate(
+            _drift_pipeline(run_id, upper), allowDiskUse=True, batchSize=BATCH_SIZE
+        )
+        drift_found, resolved = await _apply_checks(db, cursor, run_id)
+
+        if full:
+            cursor = db[models.COLLECTION_CARDS].aggregate(
+                _unledgered_cards_pipeline(upper), allowDiskUse=True, batchSize=BATCH_SIZE
+            )
+            recorded, _ = await _apply_checks(db, cursor, run_id)
+            drift_found += recorded
+
+        summary = {
+            "run_id": str(run_id),
+            "full": full,
+            "cards_checked": cards_checked,
+            "drift_found": drift_found,
+            "resolved": resolved,
+            "duration_seconds": round(time.monotonic() - started, 3),
+            "finished_at": datetime.utcnow()
+        }
+        await state_coll.update_one(
+            {"_id": STATE_ID},
+            {"$set": {"watermark": upper, "last_run": summary}, "$unset": {"in_progress": ""}}
+        )
+        return summary
+
+
+async def reconciliation_worker(db, interval: int = RECONCILIATION_INTERVAL_SECONDS):
+    """Background loop started by the app; runs once per interval, counted from the last finished run."""
+    while True:
+        state = await db[models.COLLECTION_RECONCILIATION_STATE].find_one({"_id": STATE_ID}) or {}
+        last_finished = (state.get("last_run") or {}).get("finished_at")
+        wait = 0
+        if last_finished:
+            wait = max(0, interval - (datetime.utcnow() - last_finished).total_seconds())
+        await asyncio.sleep(wait)
+
+        try:
+            summary = await run_reconciliation(db)
+            print(f"Reconciliation finished: {summary}")
+        except Exception as e:
+            print(f"Reconciliation failed: {e}")
+            await asyncio.sleep(interval)
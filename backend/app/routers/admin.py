@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from .. import models, schemas, security, database
+from typing import Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from .. import models, schemas, security, database, reconciliation
+from ..overview import overview_snapshot
 from ..dependencies import verify_admin
 from ..dependencies import get_current_user
 from ..security import create_secretkey
+from ..machine_auth import machine_keys
 
 router = APIRouter(
     prefix="/admin",
@@ -67,6 +70,11 @@ async def new_machine(
 
     # Create new machine linked to manage's arcade
     arcade_id = current_user.get("arcade_id") or "SYSTEM_ARCADE"
+
+    # Terminals authenticate by arcade + machine ID, so that pair must be unique
+    existing_machine = await db[models.COLLECTION_MACHINES].find_one({"id": machine_data.id, "arcade_id": arcade_id})
+    if existing_machine:
+        raise HTTPException(status_code=409, detail=f"Machine {machine_data.id} already exists in this arcade")
     new_machine_dict = {
         **machine_data.model_dump(),
         "arcade_id":arcade_id,
@@ -76,6 +84,7 @@ async def new_machine(
     }
     print(new_machine_dict)
     await db[models.COLLECTION_MACHINES].insert_one(new_machine_dict)
+    machine_keys.invalidate(arcade_id, machine_data.id)
     
     # Log the creation
     log = {
@@ -88,3 +97,53 @@ async def new_machine(
     await db[models.COLLECTION_LOGS].insert_one(log)
     
     return new_machine_dict
+
+@router.get("/reconciliation")
+async def get_reconciliation_findings(
+    status_filter: Optional[str] = Query("OPEN", alias="status"),
+    arcade_id: Optional[str] = None,
+    db = Depends(database.get_db),
+    _ = Depends(verify_admin)
+):
+    # Latest run summary plus the cards whose balance disagrees with the ledger
+    state = await db[models.COLLECTION_RECONCILIATION_STATE].find_one({"_id": reconciliation.STATE_ID}) or {}
+
+    query = {}
+    if status_filter:
+        query["status"] = status_filter
+    if arcade_id:
+        query["arcade_id"] = arcade_id
+
+    cursor = db[models.COLLECTION_RECONCILIATION_FINDINGS].find(query).sort("last_seen_at", -1)
+    findings = await cursor.to_list(length=100)
+    for f in findings:
+        f["_id"] = str(f["_id"])
+        f["run_id"] = str(f["run_id"])
+
+    return {
+        "running": reconciliation.is_running(),
+        "last_run": state.get("last_run"),
+        "findings": findings
+    }
+
+@router.post("/reconciliation/run", status_code=status.HTTP_202_ACCEPTED)
+async def trigger_reconciliation(
+    background_tasks: BackgroundTasks,
+    full: bool = False,
+    db = Depends(database.get_db),
+    _ = Depends(verify_admin)
+):
+    if reconciliation.is_running():
+        raise HTTPException(status_code=409, detail="Reconciliation is already running")
+
+    background_tasks.add_task(reconciliation.run_reconciliation, db, full)
+    return {"message": "Reconciliation started", "full": full}
+
+@router.get("/overview")
+async def get_overview(
+    refresh: bool = False,
+    db = Depends(database.get_db),
+    _ = Depends(verify_admin)
+):
+    # Network-wide cards, machines and today's revenue per arcade, served from a shared snapshot
+    return await overview_snapshot.get(db, force=refresh)
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
-from .. import models, schemas, database
+from typing import Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from bson import ObjectId
+from bson.errors import InvalidId
+from .. import models, schemas, database, bulk_cards, analytics
 from ..dependencies import get_current_user
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 router = APIRouter(
     prefix="/manager",
@@ -204,6 +207,122 @@ async def get_cards(
             
     return cards
 
+@router.post("/cards/bulk-action", status_code=status.HTTP_202_ACCEPTED)
+async def bulk_card_action(
+    data: schemas.BulkCardAction,
+    background_tasks: BackgroundTasks,
+    db = Depends(database.get_db),
+    current_user = Depends(get_current_user)
+):
+    # Security: Ensure only a manager/admin can do this
+    if current_user.get("role") not in ["manager", "administrator", "admin"]:
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+    if (data.card_ids is None) == (data.filter is None):
+        raise HTTPException(status_code=400, detail="Provide either card_ids or filter")
+    if data.action == "recharge" and data.amount is None:
+        raise HTTPException(status_code=400, detail="amount is required for recharge")
+    if data.card_ids is not None and not data.card_ids:
+        raise HTTPException(status_code=400, detail="card_ids must not be empty")
+    if data.filter is not None:
+        # An empty filter would hit every card in the arcade (or, for an admin, every arcade)
+        if not bulk_cards.has_filter_criteria(data.filter):
+            raise HTTPException(status_code=400, detail="filter must set status, min_balance or max_balance")
+        if current_user.get("role") != "manager" and not data.filter.arcade_id:
+            raise HTTPException(status_code=400, detail="filter.arcade_id is required for administrators")
+
+    query = bulk_cards.build_card_query(data, current_user)
+    total = await db[models.COLLECTION_CARDS].count_documents(query)
+    arcade_id = query.get("arcade_id") or current_user.get("arcade_id")
+
+    job = {
+        "type": "BULK_CARD_ACTION",
+        "action": data.action,
+        "amount": data.amount,
+        "arcade_id": arcade_id,
+        # Kept so a failed job can be resumed with the same cards
+        "selection": {
+            "card_ids": data.card_ids,
+            "filter": data.filter.model_dump() if data.filter else None
+        },
+        "created_by": current_user.get("username"),
+        "created_by_role": current_user.get("role"),
+        "status": "PENDING",
+        "total": total,
+        "processed": 0,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow()
+    }
+    result = await db[models.COLLECTION_JOBS].insert_one(job)
+
+    background_tasks.add_task(
+        bulk_cards.run_bulk_card_action, db, result.inserted_id, data.action, query, data.amount, arcade_id
+    )
+    return {"message": "Bulk action started", "job_id": str(result.inserted_id), "total": total}
+
+@router.get("/cards/bulk-action/{job_id}")
+async def get_bulk_card_action(
+    job_id: str,
+    db = Depends(database.get_db),
+    current_user = Depends(get_current_user)
+):
+    try:
+        query = {"_id": ObjectId(job_id)}
+    except InvalidId:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if current_user.get("role") == "manager":
+        query["arcade_id"] = current_user.get("arcade_id")
+
+    job = await db[models.COLLECTION_JOBS].find_one(query)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    job = await bulk_cards.fail_if_stale(db, job)
+    job["_id"] = str(job["_id"])
+    job["id"] = job["_id"]
+    if job.get("last_id"):
+        job["last_id"] = str(job["last_id"])
+    return job
+
+@router.post("/cards/bulk-action/{job_id}/resume", status_code=status.HTTP_202_ACCEPTED)
+async def resume_bulk_card_action(
+    job_id: str,
+    background_tasks: BackgroundTasks,
+    db = Depends(database.get_db),
+    current_user = Depends(get_current_user)
+):
+    # Security: Ensure only a manager/admin can do this
+    if current_user.get("role") not in ["manager", "administrator", "admin"]:
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+    try:
+        query = {"_id": ObjectId(job_id)}
+    except InvalidId:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if current_user.get("role") == "manager":
+        query["arcade_id"] = current_user.get("arcade_id")
+
+    job = await db[models.COLLECTION_JOBS].find_one(query)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = await bulk_cards.fail_if_stale(db, job)
+    if job["status"] != "FAILED" or "selection" not in job:
+        raise HTTPException(status_code=409, detail="Only failed jobs can be resumed")
+
+    # Claim the job, so two resumes of the same job cannot both run
+    claimed = await db[models.COLLECTION_JOBS].update_one(
+        {"_id": job["_id"], "status": "FAILED"},
+        {"$set": {"status": "PENDING", "updated_at": datetime.utcnow()}, "$unset": {"error": "", "finished_at": ""}}
+    )
+    if not claimed.modified_count:
+        raise HTTPException(status_code=409, detail="Job is already being resumed")
+
+    background_tasks.add_task(
+        bulk_cards.run_bulk_card_action, db, job["_id"], job["action"], bulk_cards.job_card_query(job),
+        job["amount"], job["arcade_id"], {"last_id": job.get("last_id"), "processed": job.get("processed", 0)}
+    )
+    return {"message": "Bulk action resumed", "job_id": job_id, "processed": job.get("processed", 0)}
+
 @router.get("/logs")
 async def get_logs(
     db = Depends(database.get_db),
@@ -248,4 +367,39 @@ async def get_transactions(
         elif "timestamp" in t:
             t["time"] = str(t["timestamp"])
             
-    return txs
\ No newline at end of file
+    return txs
+
+@router.get("/analytics")
+async def get_analytics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    days: int = Query(30, gt=0, le=366),
+    arcade_id: Optional[str] = None,
+    db = Depends(database.get_db),
+    current_user = Depends(get_current_user)
+):
+    # Machine heatmaps, spend per visit and recharge-to-play conversion for one arcade
+    if current_user.get("role") not in ["manager", "administrator", "admin"]:
+        raise HTTPException(status_code=403, detail="Permission denied")
+
+    if current_user.get("role") == "manager":
+        arcade_id = current_user.get("arcade_id")
+    if not arcade_id:
+        raise HTTPException(status_code=400, detail="arcade_id is required")
+
+    # Stored timestamps are naive UTC
+    if start and start.tzinfo:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    if end and end.tzinfo:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+
+    if start is None and end is None:
+        start, end = analytics.default_window(days)
+    elif start is None:
+        start = end - timedelta(days=days)
+    elif end is None:
+        end = start + timedelta(days=days)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    return await analytics.get_report(db, arcade_id, start, end)
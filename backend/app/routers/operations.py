@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from .. import models, schemas, database
 from ..dependencies import get_current_user
+from ..machine_auth import get_terminal_or_user
 
 router = APIRouter(
     prefix="/ops",
@@ -12,7 +13,7 @@ router = APIRouter(
 async def punch_card(
     data: schemas.PunchRequest, 
     db = Depends(database.get_db),
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_terminal_or_user)
 ):
     arcade_id = current_user.get("arcade_id")
     
@@ -23,10 +24,16 @@ async def punch_card(
     })
 
     # 2. Find the machine
-    machine = await db[models.COLLECTION_MACHINES].find_one({
-        "id": data.machine_id,
-        "arcade_id": arcade_id
-    })
+    if current_user.get("role") == "machine":
+        # A signed terminal can only punch for itself, and its record is already cached
+        if data.machine_id != current_user["username"]:
+            raise HTTPException(status_code=403, detail="Terminal cannot punch for another machine")
+        machine = current_user["machine"]
+    else:
+        machine = await db[models.COLLECTION_MACHINES].find_one({
+            "id": data.machine_id,
+            "arcade_id": arcade_id
+        })
 
     if not card:
         raise HTTPException(status_code=404, detail="Card not found in this arcade")
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Literal
 from datetime import datetime
 
 # --- CARD SCHEMAS ---
@@ -37,6 +37,18 @@ class TokenData(BaseModel):
     role: Optional[str] = None
     arcade_id: Optional[str] = None
 
+class BulkCardFilter(BaseModel):
+    status: Optional[str] = None
+    min_balance: Optional[float] = None
+    max_balance: Optional[float] = None
+    arcade_id: Optional[str] = None # Admin only, managers are always scoped to their arcade
+
+class BulkCardAction(BaseModel):
+    action: Literal["recharge", "block", "unblock", "delete"]
+    card_ids: Optional[List[str]] = None
+    filter: Optional[BulkCardFilter] = None
+    amount: Optional[float] = Field(None, gt=0) # Required for recharge
+
 class RefundRequest(BaseModel):
     card_id: str
     reason: Optional[str] = "Customer request"    
@@ -1,4 +1,6 @@
 import os
+import hmac
+import hashlib
 import secrets 
 from datetime import datetime, timedelta
 from typing import Optional
@@ -35,3 +37,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 def create_secretkey():
     return secrets.token_hex(32)
+
+def sign_machine_request(secret_key: str, timestamp: str, nonce: str, body: bytes) -> str:
+    # Terminals sign "<timestamp>.<nonce>.<raw body>" with their machine secret
+    message = f"{timestamp}.{nonce}.".encode() + body
+    return hmac.new(secret_key.encode(), message, hashlib.sha256).hexdigest()
@@ -1,20 +1,77 @@
+"""
+Synthetic data generator for the arcade database.
+
+Writes arcades, machines, cards and months of transaction history in the
+same shape the routers read and write, so the API, indexes and rollups can
+be profiled against production-sized data. The same --seed always produces
+the same dataset.
+
+    python seed_db.py                                   # small demo dataset
+    python seed_db.py --arcades 20 --cards-per-arcade 20000 \\
+        --visits-per-day 2000 --months 6 --drop         # tens of millions of rows
+"""
+import argparse
 import asyncio
+import bisect
 import os
+import random
+import time
+import urllib.parse
+from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
-import urllib.parse
+from app import analytics, reconciliation
 
 # Import collection names from models
 COLLECTION_ARCADES = "arcades"
 COLLECTION_USERS = "users"
 COLLECTION_MACHINES = "machines"
 COLLECTION_CARDS = "cards"
+COLLECTION_TRANSACTIONS = "transactions"
+COLLECTION_LEDGER_BALANCES = "ledger_balances"
+COLLECTION_RECONCILIATION_FINDINGS = "reconciliation_findings"
+COLLECTION_RECONCILIATION_STATE = "reconciliation_state"
+COLLECTION_JOBS = "jobs"
 
 load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "arcade_db")
 
+CITIES = [
+    ("Delhi", "DLH"), ("Mumbai", "MUM"), ("Bengaluru", "BLR"), ("Chennai", "CHN"),
+    ("Kolkata", "KOL"), ("Hyderabad", "HYD"), ("Pune", "PUN"), ("Jaipur", "JAI"),
+    ("Ahmedabad", "AMD"), ("Lucknow", "LKO"), ("Chandigarh", "CHD"), ("Kochi", "KOC"),
+]
+ARCADE_NAMES = ["Nexus Arcade", "GameZone", "Pixel Palace", "Fun City", "Level Up", "Joystick Junction"]
+
+# (name, type, cost_per_play)
+MACHINE_CATALOG = [
+    ("Street Fighter 6", "Arcade", 50), ("Mario Kart DX", "Racing", 100), ("Air Hockey", "Sports", 80),
+    ("Claw Machine", "Prize", 150), ("Tekken 8", "Arcade", 50), ("Daytona USA", "Racing", 100),
+    ("Basketball Pro", "Sports", 60), ("Coin Pusher", "Prize", 40), ("Dance Dance Revolution", "Rhythm", 80),
+    ("Time Crisis 5", "Shooter", 120), ("Bowling Alley", "Sports", 150), ("Whack-a-Mole", "Kids", 30),
+]
+# Mostly healthy floors, with a few machines down at any time
+MACHINE_STATUSES = ["ONLINE"] * 14 + ["BUSY"] * 3 + ["OFFLINE", "MAINTENANCE"]
+# Only these take swipes; OFFLINE and MAINTENANCE machines get no plays in the history
+PLAYABLE_STATUSES = ("ONLINE", "BUSY")
+
+FIRST_NAMES = ["Aarav", "Vivaan", "Aditya", "Mansi", "Ananya", "Diya", "Ishaan", "Kabir", "Meera", "Riya", "Rohan", "Sara"]
+LAST_NAMES = ["Sharma", "Verma", "Gupta", "Singh", "Iyer", "Reddy", "Patel", "Das", "Nair", "Khan"]
+
+RECHARGE_AMOUNTS = [200, 500, 1000, 2000]
+RECHARGE_WEIGHTS = [30, 40, 22, 8]
+
+# Relative footfall by hour of day
+HOURLY_WEIGHTS = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2, 4, 6, 7, 7, 8, 10, 12, 14, 14, 12, 9, 5, 2]
+# Monday .. Sunday
+WEEKDAY_WEIGHTS = [0.8, 0.75, 0.8, 0.9, 1.3, 1.9, 1.8]
+
+REFUND_PROBABILITY = 0.003
+BLOCKED_CARD_RATIO = 0.02
+
+
 def get_safe_mongodb_url(url: str) -> str:
     if not url or "://" not in url:
         return url
@@ -26,48 +83,296 @@ def get_safe_mongodb_url(url: str) -> str:
             return f"{scheme}://{urllib.parse.quote_plus(username)}:{urllib.parse.quote_plus(password)}@{host_part}"
     return url
 
-async def seed_data():
-    client = AsyncIOMotorClient(get_safe_mongodb_url(MONGODB_URL))
-    db = client[DATABASE_NAME]
 
-    print(f"Connecting to database: {DATABASE_NAME}...")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic arcade dataset.")
+    parser.add_argument("--arcades", type=int, default=2, help="number of arcades")
+    parser.add_argument("--machines-per-arcade", type=int, default=8)
+    parser.add_argument("--cards-per-arcade", type=int, default=200)
+    parser.add_argument("--months", type=int, default=1, help="months of transaction history, ending yesterday")
+    parser.add_argument("--visits-per-day", type=int, default=100, help="average card visits per arcade per day")
+    parser.add_argument("--seed", type=int, default=42, help="random seed; same seed, same data")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="documents per insert_many")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent insert coroutines")
+    parser.add_argument("--managers", action="store_true", help="also create manager_<arcade_id> / manager123 logins")
+    parser.add_argument("--drop", action="store_true", help="clear arcades, machines, cards, transactions, reconciliation state and jobs first")
+    parser.add_argument("--mongodb-url", default=MONGODB_URL)
+    parser.add_argument("--database", default=DATABASE_NAME)
+    return parser.parse_args()
+
+
+def skewed_picker(rng, items, exponent):
+    """
+    Returns a function picking from items with a Zipf-like skew, so a few
+    entries (hot machines, regular customers) get most of the traffic.
+    """
+    items = list(items)
+    rng.shuffle(items)
+    cum_weights = []
+    total = 0.0
+    for rank in range(len(items)):
+        total += 1.0 / (rank + 1) ** exponent
+        cum_weights.append(total)
+
+    def pick():
+        return items[bisect.bisect_left(cum_weights, rng.random() * total)]
+    return pick
+
+
+def build_arcades(rng, count):
+    arcades = []
+    for i in range(count):
+        city, code = CITIES[i % len(CITIES)]
+        arcades.append({
+            "id": f"ARC_{code}_{i // len(CITIES) + 1:02d}",
+            "name": f"{rng.choice(ARCADE_NAMES)} {city}",
+            "location": city
+        })
+    return arcades
+
+
+def build_machines(rng, arcade, count):
+    machines = []
+    for i in range(count):
+        name, machine_type, cost = MACHINE_CATALOG[i % len(MACHINE_CATALOG)]
+        machines.append({
+            "id": f"{arcade['id']}-M{i + 1:03d}",
+            "name": name if i < len(MACHINE_CATALOG) else f"{name} #{i // len(MACHINE_CATALOG) + 1}",
+            "type": machine_type,
+            "cost_per_play": float(cost),
+            "arcade_id": arcade["id"],
+            "secret_key": "%064x" % rng.getrandbits(256),
+            "status": rng.choice(MACHINE_STATUSES)
+        })
+    return machines
+
+
+def build_cards(rng, arcade, count, history_start, used_ids):
+    cards = []
+    for _ in range(count):
+        # 8 hex digits, like the UIDs the RFID readers report
+        card_id = "%08X" % rng.getrandbits(32)
+        while card_id in used_ids:
+            card_id = "%08X" % rng.getrandbits(32)
+        used_ids.add(card_id)
+        cards.append({
+            "card_id": card_id,
+            "owner_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "contact_no": f"9{rng.randrange(10 ** 9):09d}",
+            "arcade_id": arcade["id"],
+            "balance": 0.0,
+            "status": "BLOCKED" if rng.random() < BLOCKED_CARD_RATIO else "ACTIVE",
+            "created_at": history_start - timedelta(days=rng.randrange(365))
+        })
+    return cards
+
+
+def generate_transactions(rng, arcade, machines, cards, history_start, days, visits_per_day):
+    """
+    Yields one arcade's ledger day by day. Card balances are updated as the
+    history is played out, so cards end up matching their ledger exactly.
+    """
+    active_cards = [c for c in cards if c["status"] == "ACTIVE"]
+    playable_machines = [m for m in machines if m["status"] in PLAYABLE_STATUSES]
+    if not active_cards or not playable_machines:
+        return
+    pick_card = skewed_picker(rng, active_cards, 0.8)
+    pick_machine = skewed_picker(rng, playable_machines, 1.1)
+    hours = list(range(24))
+    arcade_id = arcade["id"]
+
+    for day in range(days):
+        day_start = history_start + timedelta(days=day)
+        # Sessions end at midnight, so the last day never spills into today
+        day_end = day_start + timedelta(days=1)
+        visits = round(visits_per_day * WEEKDAY_WEIGHTS[day_start.weekday()] * rng.uniform(0.85, 1.15))
+        visit_hours = rng.choices(hours, weights=HOURLY_WEIGHTS, k=visits)
 
-    # 1. Clear existing data (optional, but good for a clean start)
-    # await db[COLLECTION_ARCADES].delete_many({})
-    # await db[COLLECTION_MACHINES].delete_many({})
-    # await db[COLLECTION_CARDS].delete_many({})
+        for hour in visit_hours:
+            card = pick_card()
+            ts = day_start + timedelta(hours=hour, seconds=rng.randrange(3600))
+
+            if card["balance"] < 200:
+                amount = float(rng.choices(RECHARGE_AMOUNTS, weights=RECHARGE_WEIGHTS)[0])
+                card["balance"] += amount
+                yield {
+                    "card_id": card["card_id"],
+                    "amount": amount,
+                    "type": "CREDIT",
+                    "terminal": "Manager Panel",
+                    "status": "SUCCESS",
+                    "timestamp": ts,
+                    "arcade_id": arcade_id
+                }
+
+            for _ in range(rng.randint(1, 12)):
+                machine = pick_machine()
+                cost = machine["cost_per_play"]
+                next_ts = ts + timedelta(seconds=rng.randint(60, 480))
+                if card["balance"] < cost or next_ts >= day_end:
+                    break
+                ts = next_ts
+                card["balance"] -= cost
+                yield {
+                    "card_id": card["card_id"],
+                    "machine_id": machine["id"],
+                    "amount": cost,
+                    "type": "PUNCH",
+                    "terminal": machine["name"],
+                    "status": "SUCCESS",
+                    "timestamp": ts,
+                    "arcade_id": arcade_id
+                }
+
+            if card["balance"] > 0 and rng.random() < REFUND_PROBABILITY and ts + timedelta(minutes=1) < day_end:
+                amount = card["balance"]
+                card["balance"] = 0.0
+                yield {
+                    "card_id": card["card_id"],
+                    "amount": amount,
+                    "type": "DEBIT",
+                    "terminal": "Manager Panel",
+                    "status": "SUCCESS",
+                    "timestamp": ts + timedelta(minutes=1),
+                    "arcade_id": arcade_id
+                }
+
+
+class ChunkedInserter:
+    """
+    Buffers documents and hands full chunks to a pool of coroutines doing
+    unordered insert_many, so generation and network I/O overlap.
+    """
+
+    def __init__(self, collection, chunk_size, concurrency):
+        self.collection = collection
+        self.chunk_size = chunk_size
+        self.queue = asyncio.Queue(maxsize=concurrency * 2)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(concurrency)]
+        self.buffer = []
+        self.inserted = 0
+
+    async def _worker(self):
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                return
+            await self.collection.insert_many(chunk, ordered=False)
+            self.inserted += len(chunk)
+
+    def _raise_if_failed(self):
+        # One failed insert stops the whole load instead of leaving put() blocked on a dead pool
+        for worker in self.workers:
+            if worker.done() and not worker.cancelled() and worker.exception():
+                for other in self.workers:
+                    other.cancel()
+                raise worker.exception()
+
+    async def _put(self, item):
+        self._raise_if_failed()
+        put = asyncio.ensure_future(self.queue.put(item))
+        while not put.done():
+            running = [w for w in self.workers if not w.done()]
+            if not running:
+                put.cancel()
+                self._raise_if_failed()
+                raise RuntimeError("all insert workers exited")
+            await asyncio.wait([put, *running], return_when=asyncio.FIRST_COMPLETED)
+            if not put.done():
+                self._raise_if_failed()
+
+    async def add(self, doc):
+        self.buffer.append(doc)
+        if len(self.buffer) >= self.chunk_size:
+            await self._put(self.buffer)
+            self.buffer = []
+
+    async def close(self):
+        if self.buffer:
+            await self._put(self.buffer)
+            self.buffer = []
+        for _ in self.workers:
+            await self._put(None)
+        await asyncio.gather(*self.workers)
+
+
+async def seed_data(args):
+    client = AsyncIOMotorClient(get_safe_mongodb_url(args.mongodb_url))
+    db = client[args.database]
+    rng = random.Random(args.seed)
+    started = time.monotonic()
+
+    print(f"Connecting to database: {args.database}...")
+
+    if args.drop:
+        for name in (COLLECTION_ARCADES, COLLECTION_MACHINES, COLLECTION_CARDS, COLLECTION_TRANSACTIONS):
+            await db[name].drop()
+        # Ledger totals and findings describe the old cards; emptied rather than dropped so the app's indexes stay
+        for name in (COLLECTION_LEDGER_BALANCES, COLLECTION_RECONCILIATION_FINDINGS,
+                     COLLECTION_RECONCILIATION_STATE, COLLECTION_JOBS):
+            await db[name].delete_many({})
+        print("Dropped existing arcades, machines, cards and transactions; cleared reconciliation state and jobs")
+
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    days = args.months * 30
+    history_start = today - timedelta(days=days)
+
+    # 1. Arcades, machines and cards are small, build them up front
+    arcades = build_arcades(rng, args.arcades)
+    machines_by_arcade = {a["id"]: build_machines(rng, a, args.machines_per_arcade) for a in arcades}
+    used_card_ids = set()
+    cards_by_arcade = {
+        a["id"]: build_cards(rng, a, args.cards_per_arcade, history_start, used_card_ids) for a in arcades
+    }
 
-    # 2. Seed Arcades
-    arcades = [
-        {"id": "ARC_DLH_01", "name": "Nexus Arcade", "location": "Delhi"},
-        {"id": "ARC_MUM_01", "name": "GameZone Mumbai", "location": "Mumbai"}
-    ]
     await db[COLLECTION_ARCADES].insert_many(arcades)
-    print("Inserted Arcades")
-
-    # 3. Seed Machines
-    machines = [
-        {"id": "M-001", "name": "Street Fighter 6", "status": "ONLINE", "type": "Arcade", "arcade_id": "ARC_DLH_01", "revenueToday": 1200, "pricePerPlay": 50},
-        {"id": "M-002", "name": "Mario Kart DX", "status": "BUSY", "type": "Racing", "arcade_id": "ARC_DLH_01", "revenueToday": 2400, "pricePerPlay": 100},
-        {"id": "M-003", "name": "Air Hockey", "status": "OFFLINE", "type": "Sports", "arcade_id": "ARC_DLH_01", "revenueToday": 450, "pricePerPlay": 80},
-        {"id": "M-004", "name": "Claw Machine", "status": "MAINTENANCE", "type": "Prize", "arcade_id": "ARC_MUM_01", "revenueToday": 0, "pricePerPlay": 150}
-    ]
-    await db[COLLECTION_MACHINES].insert_many(machines)
-    print("Inserted Machines")
-
-    # 4. Seed Cards
-    cards = [
-        {"card_id": "CARD-8832", "balance": 450.0, "status": "ACTIVE", "arcade_id": "ARC_DLH_01", "issued_to": "Guest #8832"},
-        {"card_id": "CARD-9941", "balance": 1200.0, "status": "ACTIVE", "arcade_id": "ARC_DLH_01", "issued_to": "Guest #9941"},
-        {"card_id": "CARD-1223", "balance": 0.0, "status": "BLOCKED", "arcade_id": "ARC_DLH_01", "issued_to": "Reported Lost"},
-        {"card_id": "81B4D605", "balance": 1000000.0, "status": "ACTIVE", "arcade_id": "ARC_DLH_01", "issued_to": "MANSI"},
-        {"card_id": "DBA66E05", "balance": 1000000.0, "status": "ACTIVE", "arcade_id": "ARC_DLH_01", "issued_to": "MANSI"}
-    ]
-    await db[COLLECTION_CARDS].insert_many(cards)
-    print("Inserted Cards")
-
-    print("Database seeding completed successfully!")
+    print(f"Inserted {len(arcades)} arcades")
+    all_machines = [m for ms in machines_by_arcade.values() for m in ms]
+    if all_machines:
+        await db[COLLECTION_MACHINES].insert_many(all_machines)
+    print(f"Inserted {len(all_machines)} machines")
+
+    # 2. Play out the history; this also settles every card's final balance
+    inserter = ChunkedInserter(db[COLLECTION_TRANSACTIONS], args.chunk_size, args.concurrency)
+    generated = 0
+    for arcade in arcades:
+        for tx in generate_transactions(
+            rng, arcade, machines_by_arcade[arcade["id"]], cards_by_arcade[arcade["id"]],
+            history_start, days, args.visits_per_day
+        ):
+            await inserter.add(tx)
+            generated += 1
+            if generated % 1_000_000 == 0:
+                rate = generated / (time.monotonic() - started)
+                print(f"  {generated:,} transactions generated ({rate:,.0f}/s)")
+    await inserter.close()
+    print(f"Inserted {inserter.inserted:,} transactions")
+
+    # 3. Cards go in last, carrying the balances their ledger adds up to
+    card_inserter = ChunkedInserter(db[COLLECTION_CARDS], args.chunk_size, args.concurrency)
+    for cards in cards_by_arcade.values():
+        for card in cards:
+            await card_inserter.add(card)
+    await card_inserter.close()
+    print(f"Inserted {card_inserter.inserted:,} cards")
+
+    if args.managers:
+        from passlib.context import CryptContext
+        hashed_pwd = CryptContext(schemes=["bcrypt"], deprecated="auto").hash("manager123")
+        await db[COLLECTION_USERS].insert_many([
+            {"username": f"manager_{a['id']}", "hashed_password": hashed_pwd, "role": "manager", "arcade_id": a["id"]}
+            for a in arcades
+        ])
+        print(f"Inserted {len(arcades)} managers (password: manager123)")
+
+    # Dropped collections lose the indexes the app created at startup; build them once the data is in
+    await reconciliation.ensure_indexes(db)
+    await analytics.ensure_indexes(db)
+    print("Created indexes")
+
+    print(f"Database seeding completed in {time.monotonic() - started:.1f}s")
     client.close()
 
+
 if __name__ == "__main__":
-    asyncio.run(seed_data())
+    asyncio.run(seed_data(parse_args()))
@@ -27,6 +27,9 @@ const INITIAL_MACHINES = [];
 const INITIAL_LOGS = [];
 const INITIAL_NOTIFICATIONS = [];
 
+// Bulk card jobs are polled once a second, at most this many times
+const MAX_BULK_POLLS = 600;
+
 // Helper to get from local storage or default
 const getStoredState = (key, defaultValue) => {
   try {
@@ -156,21 +159,50 @@ export const AppProvider = ({ children }) => {
 
   // --- Actions ---
 
-  const bulkDeleteCards = (ids) => {
-    setInventory(prev => prev.filter(c => !ids.includes(c.id)));
-    addLog('WARNING', `Bulk deleted ${ids.length} cards: ${ids.join(', ')}`, 'Inventory');
-  };
+  // Runs a server-side bulk job and polls it until it finishes
+  const runBulkCardAction = async (action, ids, amount) => {
+    try {
+      const payload = { action, card_ids: ids };
+      if (amount !== undefined) payload.amount = amount;
+      const response = await api.post('/manager/cards/bulk-action', payload);
+      const jobId = response.data.job_id;
+
+      // Give up after ~10 minutes; the server marks jobs that stop reporting as FAILED
+      let job = { status: 'PENDING' };
+      let attempts = 0;
+      while (job.status === 'PENDING' || job.status === 'RUNNING') {
+        if (attempts >= MAX_BULK_POLLS) {
+          addLog('WARNING', `Bulk ${action} is still running, check the logs later`, 'Inventory');
+          return { success: false, message: 'Bulk action is taking longer than expected' };
+        }
+        attempts += 1;
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        job = (await api.get(`/manager/cards/bulk-action/${jobId}`)).data;
+      }
 
-  const bulkBlockCards = (ids) => {
-    setInventory(prev => prev.map(c => ids.includes(c.id) ? { ...c, status: 'BLOCKED' } : c));
-    addLog('WARNING', `Bulk blocked ${ids.length} cards`, 'Inventory');
-  };
+      await fetchCards();
+      await fetchLogs();
+      if (action === 'recharge') await fetchTransactions();
 
-  const bulkRechargeCards = (ids, amount) => {
-    setInventory(prev => prev.map(c => ids.includes(c.id) ? { ...c, balance: c.balance + amount } : c));
-    addLog('INFO', `Bulk recharged ${ids.length} cards with ${amount} tokens`, 'Inventory');
+      if (job.status === 'FAILED') {
+        addLog('ERROR', `Bulk ${action} failed: ${job.error}`, 'Inventory');
+        return { success: false, message: job.error };
+      }
+      return { success: true, processed: job.processed };
+    } catch (error) {
+      console.error(`Bulk ${action} failed:`, error);
+      const errorMsg = error.response?.data?.detail || `Bulk ${action} failed`;
+      addLog('ERROR', errorMsg, 'Inventory');
+      return { success: false, message: errorMsg };
+    }
   };
 
+  const bulkDeleteCards = (ids) => runBulkCardAction('delete', ids);
+
+  const bulkBlockCards = (ids) => runBulkCardAction('block', ids);
+
+  const bulkRechargeCards = (ids, amount) => runBulkCardAction('recharge', ids, amount);
+
   const replaceCard = (oldCardId, newCardId) => {
     const oldCard = inventory.find(c => c.id === oldCardId);
     if (!oldCard) return { success: false, message: 'Old card not found' };